@@ -1,73 +1,135 @@
 from flask import Flask, render_template, request, jsonify
+from flask.json.provider import DefaultJSONProvider
+import io
 import json
 import re
-import uuid
+import heapq
 import html
 from pathlib import Path
-from datetime import timedelta
+from itertools import count
+import orjson
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """
+    Serialize jsonify() responses with orjson instead of the stdlib encoder.
+    sort_keys (the provider attribute or a dumps() kwarg) and indent map to orjson's
+    OPT_SORT_KEYS and fixed 2-space OPT_INDENT_2, so output keeps the default
+    provider's alphabetical key order; other json.dumps/json.loads kwargs are ignored.
+    response() uses Flask-private _prepare_response_obj and _app, which ties this
+    class to the pinned Flask==3.1.2.
+    """
+
+    def dumps(self, obj, **kwargs):
+        option = orjson.OPT_SORT_KEYS if kwargs.get("sort_keys", self.sort_keys) else 0
+        if kwargs.get("indent"):
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=self.default, option=option).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        # Hand orjson's bytes straight to the response instead of round-tripping through str
+        obj = self._prepare_response_obj(args, kwargs)
+        option = orjson.OPT_APPEND_NEWLINE
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if (self.compact is None and self._app.debug) or self.compact is False:
+            option |= orjson.OPT_INDENT_2
+        return self._app.response_class(
+            orjson.dumps(obj, default=self.default, option=option), mimetype=self.mimetype
+        )
+
 
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
+
+_STRIP_TABLE = str.maketrans('', '', '*[]')
+_WS = re.compile(r'\s+')
+_INDENTS = tuple('  ' * d for d in range(64))
+
+_STATUS_MEANINGS = {
+    "ok": "Task succeeded (no error)",
+    "changed": "Task made changes on target host",
+    "fatal": "Task failed",
+    "skipped": "Task was skipped",
+    "unreachable": "Host was unreachable",
+    "rescued": "Task failed but rescued by 'rescue' block",
+    "ignored": "Failure ignored via 'ignore_errors'"
+}
 
 # Utility: clean labels to remove *, [, ], and extra whitespace
 def clean_label(label):
     if not label:
         return ""
-    cleaned = re.sub(r'[\*\[\]]', '', str(label))
-    cleaned = re.sub(r'\s+', ' ', cleaned)
+    cleaned = str(label).translate(_STRIP_TABLE)
+    # Any whitespace other than a single ASCII space is non-printable, so clean labels skip the regex
+    if '  ' in cleaned or not cleaned.isprintable():
+        cleaned = _WS.sub(' ', cleaned)
     return cleaned.strip()
 
-def nid():
-    return str(uuid.uuid4())
-
-def build_mindmap_from_ansible(ansible_json):
-    root_id = nid()
-    nodes = [{"id": root_id, "label": "Playbook Output", "title": "Root: Playbook Output"}]
-    edges = []
+def build_mindmap_from_ansible(ansible_json, tasks_are_dicts=False, top_n=0):
+    # Node ids only need to be unique within a single response
+    _ids = count()
+    nid = lambda: next(_ids)
 
+    # The nested tree is the only view the frontend uses; add_node links each node into it.
+    # "title" is only sent when it differs from "label"; the viewer falls back to the label.
     def add_node(label, title=None, parent=None, group=None):
-        _id = nid()
-        node = {"id": _id, "label": label, "title": title or label}
+        node = {"id": nid(), "label": label, "children": []}
+        if title:
+            node["title"] = title
         if group:
             node["group"] = group
-        nodes.append(node)
-        if parent:
-            edges.append({"from": parent, "to": _id})
-        return _id
-
-    status_meanings = {
-        "ok": "Task succeeded (no error)",
-        "changed": "Task made changes on target host",
-        "fatal": "Task failed",
-        "skipped": "Task was skipped",
-        "unreachable": "Host was unreachable",
-        "rescued": "Task failed but rescued by 'rescue' block",
-        "ignored": "Failure ignored via 'ignore_errors'"
-    }
+        if parent is not None:
+            parent["children"].append(node)
+        return node
+
+    nested_json = add_node("Playbook Output", title="Root: Playbook Output")
+
+    # With top_n, the slowest tasks are collected during the same walk into a bounded
+    # min-heap of (duration, -seq, entry); -seq keeps earlier tasks first on ties
+    top_heap = []
+    seq = count()
 
     plays = ansible_json.get("plays", [])
     if isinstance(plays, list) and plays:
-        plays_parent = add_node("Plays", parent=root_id, group="plays")
+        plays_parent = add_node("Plays", parent=nested_json, group="plays")
 
         for play_index, play in enumerate(plays, 1):
             play_name = clean_label(play.get("name") or play.get("play", {}).get("name") or f"Play {play_index}")
-            play_id = add_node(play_name, parent=plays_parent, group="play")
+            play_node = add_node(play_name, parent=plays_parent, group="play")
 
-            tasks_parent = add_node("Tasks", parent=play_id, group="tasks")
+            tasks_parent = add_node("Tasks", parent=play_node, group="tasks")
             tasks = play.get("tasks") or play.get("tasks_results") or play.get("tasks_list") or []
             if isinstance(tasks, list) and tasks:
                 for task_index, task in enumerate(tasks, 1):
-                    if isinstance(task, dict):
+                    is_dict = tasks_are_dicts or isinstance(task, dict)
+                    if is_dict:
                         tname = task.get("name") or task.get("task", {}).get("name") or task.get("action") or f"Task {task_index}"
                     else:
                         tname = str(task)
                     tname_clean = clean_label(tname)
                     task_label = f"{task_index:02d}. {tname_clean}"
-                    task_id = add_node(task_label, parent=tasks_parent, group="task")
-
-                    hosts = task.get("hosts") if isinstance(task, dict) else None
+                    task_node = add_node(task_label, parent=tasks_parent, group="task")
+
+                    duration = _task_duration(task) if top_n and is_dict else None
+                    if duration is not None and (len(top_heap) < top_n or duration > top_heap[0][0]):
+                        entry = {
+                            "play": play.get("name") or f"Play {play_index}",
+                            "task": task.get("name") or f"Task {task_index}",
+                            "duration_seconds": duration
+                        }
+                        if len(top_heap) < top_n:
+                            heapq.heappush(top_heap, (duration, -next(seq), entry))
+                        else:
+                            heapq.heapreplace(top_heap, (duration, -next(seq), entry))
+
+                    hosts = task.get("hosts") if is_dict else None
                     if hosts and isinstance(hosts, dict):
                         for host, result in hosts.items():
-                            host_node = add_node(f"Host: {host}", parent=task_id)
+                            host_node = add_node(f"Host: {host}", parent=task_node)
                             if isinstance(result, dict):
                                 for k, v in result.items():
                                     if isinstance(v, (str, int, float)):
@@ -75,100 +137,154 @@ def build_mindmap_from_ansible(ansible_json):
 
     recap = ansible_json.get("stats") or ansible_json.get("playbook_recap") or {}
     if recap:
-        recap_parent = add_node("Play Recap", parent=root_id, group="recap")
+        recap_parent = add_node("Play Recap", parent=nested_json, group="recap")
         for host, results in recap.items():
-            host_id = add_node(f"Host: {host}", parent=recap_parent)
+            host_node = add_node(f"Host: {host}", parent=recap_parent)
             if isinstance(results, dict):
                 for k, v in results.items():
-                    add_node(f"{k}: {v}", parent=host_id, group="recap-item")
-
-    id_to_node = {n['id']: {**n, 'children': []} for n in nodes}
-    for e in edges:
-        id_to_node[e['from']]['children'].append(id_to_node[e['to']])
-    nested_json = id_to_node[root_id]
-
-    def to_markdown(node, depth=0):
-        indent = "  " * depth
-        lines = [f"{indent}- {node['label']}"]
-        for c in node.get('children', []):
-            lines.extend(to_markdown(c, depth + 1))
-        return lines
-
-    markdown = "\n".join(to_markdown(nested_json))
-    return {"nodes": nodes, "edges": edges, "nested_json": nested_json, "markdown": markdown, "status_meanings": status_meanings}
-
-
-def get_top_time_consuming_tasks(ansible_json, top_n=20):
-    task_durations = []
-    plays = ansible_json.get("plays", [])
-    for play_index, play in enumerate(plays, 1):
-        play_name = play.get("name") or f"Play {play_index}"
-        tasks = play.get("tasks") or play.get("tasks_results") or play.get("tasks_list") or []
+                    add_node(f"{k}: {v}", parent=host_node, group="recap-item")
+
+    # Pre-order walk with an explicit stack; avoids recursion on deep playbooks
+    buf = io.StringIO()
+    sep = ""
+    stack = [(nested_json, 0)]
+    while stack:
+        node, depth = stack.pop()
+        buf.write(sep)
+        buf.write(_INDENTS[depth] if depth < 64 else '  ' * depth)
+        buf.write('- ')
+        buf.write(node['label'])
+        sep = "\n"
+        stack.extend((c, depth + 1) for c in reversed(node.get('children', [])))
+
+    markdown = buf.getvalue()
+    mind = {"nested_json": nested_json, "markdown": markdown, "status_meanings": _STATUS_MEANINGS}
+    if top_n:
+        mind[f"top_{top_n}_time_consuming_tasks"] = [entry for _, _, entry in sorted(top_heap, reverse=True)]
+    return mind
+
+
+def _task_duration(task):
+    """Return a task's duration in seconds, or None if the task has no timing data."""
+    if "duration" in task and isinstance(task["duration"], (int, float)):
+        return float(task["duration"])
+    elif "duration_seconds" in task:
+        return float(task["duration_seconds"])
+    elif "duration" in task and isinstance(task["duration"], dict):
+        return float(task["duration"].get("elapsed", 0))
+    return None
+
+
+_PLAY_PATTERN = re.compile(r"^PLAY \[(.+?)\]")
+_TASK_PATTERN = re.compile(r"^TASK \[(.+?)\]")
+_TIME_PATTERN = re.compile(r"\((\d+):(\d+):(\d+\.\d+)\)")
+_FAIL_PATTERN = re.compile(r"^(fatal|failed|unreachable): \[(.+?)\]: (.+)", re.IGNORECASE)
+_WARN_PATTERN = re.compile(r"\bwarning\b|\bwarn\b", re.IGNORECASE)
+
+def _failed_task_from_line(line, play_name, task_name):
+    """Return a failed task entry for a stripped log line, or None if it is not a failure."""
+    fail_match = _FAIL_PATTERN.match(line)
+    # Skip warnings
+    if not fail_match or _WARN_PATTERN.search(line):
+        return None
+    _, host, msg = fail_match.groups()
+    msg = msg.replace('FAILED! =>', '').replace('=>', '').strip()
+    return {
+        "play": play_name or "(unknown play)",
+        "task": task_name or "(unknown task)",
+        "host": host,
+        "message": msg or "(no message)"
+    }
 
-        for task_index, task in enumerate(tasks, 1):
-            if not isinstance(task, dict):
-                continue
-            task_name = task.get("name") or f"Task {task_index}"
-            duration = None
-            if "duration" in task and isinstance(task["duration"], (int, float)):
-                duration = float(task["duration"])
-            elif "duration_seconds" in task:
-                duration = float(task["duration_seconds"])
-            elif "duration" in task and isinstance(task["duration"], dict):
-                duration = float(task["duration"].get("elapsed", 0))
-            if duration is None:
-                continue
-            task_durations.append({"play": play_name, "task": task_name, "duration_seconds": duration})
-    return sorted(task_durations, key=lambda x: x["duration_seconds"], reverse=True)[:top_n]
+def _iter_upload_lines(stream):
+    """Yield decoded lines from a binary upload stream without reading it whole."""
+    # readline() exists on every stream Werkzeug hands out (SpooledTemporaryFile has no
+    # readable() before Python 3.11, so io.TextIOWrapper can't wrap it there).
+    # readline() only splits on b"\n"; splitlines() also breaks on \r, \x0b, \x1c, \u2028
+    # etc., matching the str.splitlines() the whole-file parser used.
+    for raw_line in iter(stream.readline, b""):
+        yield from raw_line.decode('utf-8', errors='ignore').splitlines()
 
-def get_failed_tasks_from_text(raw_log):
+def _parse_text_log(lines):
     """
-    Parse Ansible text logs and return structured failed task details.
-    Example output:
-    [
-        {"play": "My Play", "task": "Setup EC2", "host": "localhost", "message": "Failed to connect..."}
-    ]
+    Parse Ansible text log lines in a single pass.
+    Returns (plays, recap, failed_tasks) where plays/recap match the JSON layout
+    build_mindmap_from_ansible expects.
     """
-    failed_tasks = []
+    plays = []
+    current_play = None
+    current_task = None
     play_name = None
     task_name = None
+    failed_tasks_list = []
+    recap = {}
+    recap_started = False
+    plays_done = False
 
-    play_pattern = re.compile(r"^PLAY \[(.+?)\]")
-    task_pattern = re.compile(r"^TASK \[(.+?)\]")
-    fail_pattern = re.compile(r"^(fatal|failed|unreachable): \[(.+?)\]: (.+)", re.IGNORECASE)
-
-    for line in raw_log.splitlines():
+    # Single pass: plays/tasks up to the first PLAY RECAP, then recap host lines.
+    # Play/task names and failures are tracked across the whole log, including later runs.
+    for line in lines:
         line = line.strip()
-
-        # Skip warnings
-        if re.search(r"\bwarning\b|\bwarn\b", line, re.IGNORECASE):
+        if line.startswith("PLAY RECAP"):
+            recap_started = True
+            plays_done = True
             continue
 
-        # Detect play
-        play_match = play_pattern.match(line)
-        if play_match:
-            play_name = play_match.group(1)
+        # Cheap prefix/substring checks first; most log lines match none of the patterns
+        if line.startswith("PLAY ["):
+            play_match = _PLAY_PATTERN.match(line)
+            if play_match:
+                play_name = play_match.group(1)
+                if not plays_done:
+                    current_play = {"name": play_name, "tasks": []}
+                    plays.append(current_play)
+                continue
+        elif line.startswith("TASK ["):
+            task_match = _TASK_PATTERN.match(line)
+            if task_match:
+                task_name = task_match.group(1)
+                if not plays_done and current_play:
+                    current_task = {"name": task_name}
+                    current_play["tasks"].append(current_task)
+                continue
+        elif ": [" in line:
+            failed = _failed_task_from_line(line, play_name, task_name)
+            if failed:
+                failed_tasks_list.append(failed)
+                continue
+
+        if recap_started:
+            # Only split lines that can hold key=value pairs
+            parts = line.split() if "=" in line else None
+            if parts and len(parts) >= 2:
+                # "host : ok=2 changed=1 ...": record it
+                rec = {}
+                for kv in parts[1:]:
+                    k, sep, v = kv.partition("=")
+                    if sep:
+                        rec[k] = v
+                if rec:
+                    recap[parts[0]] = rec
+            elif line and " " not in line and "\t" not in line:
+                # A single-token line ends the recap block
+                recap_started = False
+            # Blank lines and other multi-word lines stay in the recap block
             continue
 
-        # Detect task
-        task_match = task_pattern.match(line)
-        if task_match:
-            task_name = task_match.group(1)
+        if plays_done:
             continue
 
-        # Detect failure
-        fail_match = fail_pattern.match(line)
-        if fail_match:
-            _, host, msg = fail_match.groups()
-            msg = msg.replace('FAILED! =>', '').replace('=>', '').strip()
-            failed_tasks.append({
-                "play": play_name or "(unknown play)",
-                "task": task_name or "(unknown task)",
-                "host": host,
-                "message": msg or "(no message)"
-            })
+        # profile_tasks lines carry the task time in the first "(H:MM:SS.mmm)" group,
+        # followed by the cumulative time, so start the scan at the first paren
+        paren = line.find("(") if current_task else -1
+        if paren != -1:
+            time_match = _TIME_PATTERN.search(line, paren)
+            if time_match:
+                hs, ms, ss = time_match.groups()
+                current_task["duration_seconds"] = int(hs) * 3600 + int(ms) * 60 + float(ss)
+                current_task = None
 
-    return failed_tasks
+    return plays, recap, failed_tasks_list
 
 
 @app.route('/')
@@ -183,71 +299,15 @@ def top_tasks_analysis():
         return jsonify({"error": "no file uploaded"}), 400
 
     try:
-        raw = file.read().decode('utf-8', errors='ignore')
-    except Exception as e:
+        # Iterate the upload line by line rather than holding the decoded log in memory
+        plays, recap, failed_tasks_list = _parse_text_log(_iter_upload_lines(file.stream))
+    except OSError as e:
         return jsonify({"error": "failed to read file", "message": str(e)}), 400
 
-    play_pattern = re.compile(r"^PLAY \[(.+?)\]")
-    task_pattern = re.compile(r"^TASK \[(.+?)\]")
-    time_pattern = re.compile(r"\((\d+):(\d+):(\d+\.\d+)\)")
-
-    plays = []
-    current_play = None
-    current_task = None
-
-    for line in raw.splitlines():
-        line = line.strip()
-        play_match = play_pattern.match(line)
-        if play_match:
-            play_name = play_match.group(1)
-            current_play = {"name": play_name, "tasks": []}
-            plays.append(current_play)
-            continue
-
-        task_match = task_pattern.match(line)
-        if task_match and current_play:
-            task_name = task_match.group(1)
-            current_task = {"name": task_name}
-            current_play["tasks"].append(current_task)
-            continue
-
-        time_match = time_pattern.search(line)
-        if time_match and current_task:
-            h, m, s = map(float, time_match.groups())
-            duration = timedelta(hours=h, minutes=m, seconds=s).total_seconds()
-            current_task["duration_seconds"] = duration
-            current_task = None
-            continue
-
-        if line.startswith("PLAY RECAP"):
-            break
-
-    recap = {}
-    recap_started = False
-    for line in raw.splitlines():
-        if line.startswith("PLAY RECAP"):
-            recap_started = True
-            continue
-        if recap_started and line.strip():
-            parts = line.split()
-            if len(parts) >= 2 and any('=' in part for part in parts[1:]):
-                host = parts[0]
-                rec = {}
-                for kv in parts[1:]:
-                    if "=" in kv:
-                        k, v = kv.split("=")
-                        rec[k] = v
-                if rec:
-                    recap[host] = rec
-            elif len(parts) < 2:
-                recap_started = False
-
+    # Tasks parsed from text are always dicts, so the mindmap's per-task type checks can be skipped
     data = {"plays": plays, "stats": recap}
-    mind = build_mindmap_from_ansible(data)
-    top_tasks_list = get_top_time_consuming_tasks(data, top_n=20)
-    mind["top_20_time_consuming_tasks"] = top_tasks_list
-    
-    failed_tasks_list = get_failed_tasks_from_text(raw)
+    mind = build_mindmap_from_ansible(data, tasks_are_dicts=True, top_n=20)
+
     print(failed_tasks_list)
     mind["failed_tasks"] = failed_tasks_list
     